@@ -1,8 +1,5 @@
 import sys
 
-from .encoder import KGPEncoderBase
-from .unicode import KGPEncoderUnicode
-from .query import KGPQuery
 from .cli_options import KGPOptions
 
 
@@ -13,6 +10,7 @@ def main(args=None):
     options = KGPOptions(KGPOptions.get_parser().parse_args(args=args))
 
     if options.do_query:
+        from .query import KGPQuery
         for k, v in KGPQuery.query_all().items():
             print(f"{k}: {v}")
         return
@@ -21,24 +19,28 @@ def main(args=None):
     sequences = []
     placeholders = []
     if options.unicode_placeholder == 1:
+        from .unicode import KGPEncoderUnicode
         encoder = KGPEncoderUnicode(options)
         sequences = encoder.construct_KGP()
         placeholders = encoder.construct_unicode_placeholders()
     else:
+        from .encoder import KGPEncoderBase
         encoder = KGPEncoderBase(options)
         sequences = encoder.construct_KGP()
 
-    for seq in sequences:
-        print(seq, end="")
+    # Everything is written at once, rather than one write per escape sequence or line
+    parts = list(sequences)
 
     # placeholders is only used when Unicode Placeholder is enabled,
-    # and will be empty otherwise, so this loop will be skipped when not needed
-    for i, line in enumerate(placeholders):
-        # Only print a newline after each line except the last one
-        print(line, end="" if i == len(placeholders) - 1 else "\n")
+    # and will be empty otherwise, so nothing will be added when not needed
+    if placeholders:
+        parts.append("\n".join(placeholders).encode("utf-8"))
 
     # Final new line
-    print("")
+    parts.append(b"\n")
+
+    sys.stdout.buffer.write(b"".join(parts))
+    sys.stdout.buffer.flush()
 
     # Delete image on user input
     # input()
@@ -1,19 +1,24 @@
 import argparse
+import functools
 import logging
-from pathlib import Path
+import os
 import sys
+from typing import TYPE_CHECKING
 
 from idog.query import KGPQuery
-from idog.utils import random_ID, terminal_dimensions
+from idog.utils import cache_dir, random_ID, terminal_dimensions
 from idog.constants import KGP_UNICODE_MAX_SIZE, KGP_TRANSMISSION_MEDIUM
 
+if TYPE_CHECKING:
+    from pathlib import Path
+
 
 class ArgParseError(Exception):
     pass
 
 
 class KGPOptions:
-    path: Path
+    path: "Path"
 
     display_cols: int
     display_rows: int
@@ -24,16 +29,24 @@ class KGPOptions:
 
     image_id: int
 
-    unicode_placeholder: int
-    transmission_medium: str
+    # As specified by the user, may need to be detected (see the properties below)
+    _unicode_placeholder: int
+    _transmission_medium: str
 
     do_query: bool
     verbose: bool
     transfer_png: bool
+    compression_level: int
+    png_level: int
 
     @staticmethod
+    @functools.lru_cache(maxsize=1)
     def get_parser() -> argparse.ArgumentParser:
         parser = argparse.ArgumentParser(description="KGP Image Display Options")
+        # add_argument() builds a fresh HelpFormatter for validating every action,
+        # share a single one while the arguments are being registered
+        formatter = parser._get_formatter()
+        parser._get_formatter = lambda: formatter
         parser.add_argument("-q", "--query", action="store_true",
                             help="Perform capability queries and quit (no image will be displayed)")
         parser.add_argument("-v", "--verbose", action="store_true", help="Enable verbose logging")
@@ -50,6 +63,13 @@ class KGPOptions:
                             help=f"Transmission medium for data (available options: {', '.join(KGP_TRANSMISSION_MEDIUM.keys())}, default: auto)")
         parser.add_argument("--image-id", type=int, default=-1, help="Image ID to use for KGP (0 to 0xFFFFFF, default: random)")
         parser.add_argument("--png", action="store_true", help="Transfer PNG data instead of raw pixel data")
+        parser.add_argument("--compression-level", type=int, default=-1,
+                            help="zlib compression level for direct transmission (0 to 9, -1: default)")
+        parser.add_argument("--png-level", type=int, default=-1,
+                            help="PNG compression level when using --png (0 to 9, -1: auto (default), "
+                                 "6 for direct transmission where payload size matters, 1 otherwise)")
+        # Restore the default behavior so that help/usage output gets a clean formatter
+        del parser._get_formatter
         return parser
 
     def __init__(self, args):
@@ -57,11 +77,13 @@ class KGPOptions:
         self.display_rows = args.height
         self.max_cols = args.max_cols
         self.max_rows = args.max_rows
-        self.unicode_placeholder = args.unicode_placeholder
+        self._unicode_placeholder = args.unicode_placeholder
         self.image_id = args.image_id
         self.do_query = args.query
         self.verbose = args.verbose
         self.transfer_png = args.png
+        self.compression_level = args.compression_level
+        self.png_level = args.png_level
         # path and transmission_medium will be handled later
 
         try:
@@ -74,6 +96,7 @@ class KGPOptions:
             # Validate path
             if args.path is None:
                 raise ArgParseError("Image path is required unless --query or --help is specified")
+            from pathlib import Path
             self.path = Path(args.path)
             if not self.path.is_file():
                 raise ArgParseError(f"Image path does not exist or is not a file: {self.path}")
@@ -82,16 +105,28 @@ class KGPOptions:
             if args.transmission_medium not in KGP_TRANSMISSION_MEDIUM.keys():
                 raise ArgParseError(
                     f"Invalid transmission medium: {args.transmission_medium}, available options are: {', '.join(KGP_TRANSMISSION_MEDIUM.keys())}")
-            self.transmission_medium = KGP_TRANSMISSION_MEDIUM[args.transmission_medium]
+            self._transmission_medium = KGP_TRANSMISSION_MEDIUM[args.transmission_medium]
 
             self._check_args()
             self._init_size()
-            self._detect_unicode_placeholder()
-            self._detect_transmission_medium()
         except ArgParseError as e:
-            logging.error(f"Argument error: {e}")
+            logging.error("Argument error: %s", e)
             exit(1)
 
+    # Detecting these may require querying the terminal, which is deferred until they are actually needed
+
+    @functools.cached_property
+    def unicode_placeholder(self) -> int:
+        """Whether to use Unicode Placeholders, 0 or 1"""
+        self._detect_unicode_placeholder()
+        return self._unicode_placeholder
+
+    @functools.cached_property
+    def transmission_medium(self) -> str:
+        """Identifier of the transmission medium to use"""
+        self._detect_transmission_medium()
+        return self._transmission_medium
+
     def _setup_logging(self) -> None:
         if self.verbose:
             logging.basicConfig(level=logging.DEBUG, format="%(message)s")
@@ -105,12 +140,20 @@ class KGPOptions:
         if self.max_rows > 0 and self.max_rows < self.display_rows:
             raise ArgParseError("max-rows cannot be less than the number of display rows")
 
+        if self._unicode_placeholder not in (-1, 0, 1):
+            raise ArgParseError("unicode-placeholder must be -1 (auto-detect), 0 (disable) or 1 (enable)")
+
         if self.image_id < -1 or self.image_id > 0xFFFFFF:
             raise ArgParseError("Image ID must be between 0 and 0xFFFFFF (inclusive)")
         if self.image_id == -1:
             self.image_id = random_ID(0xFFFFFF)
 
-        logging.debug(f"Image ID: {self.image_id}")
+        logging.debug("Image ID: %d", self.image_id)
+
+        if self.compression_level < -1 or self.compression_level > 9:
+            raise ArgParseError("Compression level must be between 0 and 9 (inclusive), or -1 for the default")
+        if self.png_level < -1 or self.png_level > 9:
+            raise ArgParseError("PNG compression level must be between 0 and 9 (inclusive), or -1 for auto")
 
     def _init_size(self) -> None:
         if self.display_cols == 0:
@@ -121,55 +164,76 @@ class KGPOptions:
         size = terminal_dimensions()
         self.cell_height = size[3] // size[1]
         self.cell_width = size[2] // size[0]
-        logging.debug(
-            f"Terminal size: {size[0]}x{size[1]} cells, cell size: {self.cell_width}x{self.cell_height} pixels")
+        logging.debug("Terminal size: %dx%d cells, cell size: %dx%d pixels",
+                      size[0], size[1], self.cell_width, self.cell_height)
 
         # If max_cols or max_rows is not specified, use the terminal dimensions as the maximum size
         if self.max_rows < 0 or self.max_cols < 0:
             if self.max_cols < 0:
                 self.max_cols = size[0]
-                logging.debug(f"Auto-detected max-cols: {self.max_cols}")
+                logging.debug("Auto-detected max-cols: %d", self.max_cols)
             if self.max_rows < 0:
                 self.max_rows = size[1]
-                logging.debug(f"Auto-detected max-rows: {self.max_rows}")
+                logging.debug("Auto-detected max-rows: %d", self.max_rows)
 
     def _detect_unicode_placeholder(self) -> None:
-        if self.unicode_placeholder == -1:
-            self.unicode_placeholder = 1 if KGPQuery.query_unicode_placeholder_support() else 0
-        elif self.unicode_placeholder not in (0, 1):
-            raise ArgParseError("unicode-placeholder must be -1 (auto-detect), 0 (disable) or 1 (enable)")
+        if self._unicode_placeholder == -1:
+            self._unicode_placeholder = 1 if KGPQuery.query_unicode_placeholder_support() else 0
 
         # Unicode Placeholder have a maximum size limit due to the limited number of diacritics
-        if self.unicode_placeholder == 1:
-            if self.display_cols > KGP_UNICODE_MAX_SIZE:
-                logging.warning(
-                    f"display width for Unicode Placeholder cannot exceed {KGP_UNICODE_MAX_SIZE} columns, disabling Unicode Placeholder")
-                self.unicode_placeholder = 0
-            elif self.display_rows > KGP_UNICODE_MAX_SIZE:
-                logging.warning(
-                    f"display height for Unicode Placeholder cannot exceed {KGP_UNICODE_MAX_SIZE} rows, disabling Unicode Placeholder")
-                self.unicode_placeholder = 0
-            elif self.max_cols > KGP_UNICODE_MAX_SIZE:
-                logging.warning(
-                    f"max-cols for Unicode Placeholder cannot exceed {KGP_UNICODE_MAX_SIZE}, disabling Unicode Placeholder")
-                self.unicode_placeholder = 0
-            elif self.max_rows > KGP_UNICODE_MAX_SIZE:
-                logging.warning(
-                    f"max-rows for Unicode Placeholder cannot exceed {KGP_UNICODE_MAX_SIZE}, disabling Unicode Placeholder")
-                self.unicode_placeholder = 0
-
-        logging.debug(f"Unicode Placeholder support: {'enabled' if self.unicode_placeholder else 'disabled'}")
+        # (-1 means unspecified / auto, which can never exceed the limit)
+        if self._unicode_placeholder == 1:
+            # Only the largest value needs to be checked, it is also the one reported
+            name, value = max((("display width", self.display_cols), ("display height", self.display_rows),
+                               ("max-cols", self.max_cols), ("max-rows", self.max_rows)), key=lambda item: item[1])
+            if value > KGP_UNICODE_MAX_SIZE:
+                logging.warning("%s for Unicode Placeholder cannot exceed %d (got %d), disabling Unicode Placeholder",
+                                name, KGP_UNICODE_MAX_SIZE, value)
+                self._unicode_placeholder = 0
+
+        logging.debug("Unicode Placeholder support: %s", "enabled" if self._unicode_placeholder else "disabled")
+
+    @staticmethod
+    def _terminal_key() -> str:
+        """Identifies the terminal the detected transmission medium is cached for"""
+        return ":".join(os.environ.get(name, "") for name in ("TERM", "KITTY_PID", "GHOSTTY_SHELL_FEATURES"))
+
+    @staticmethod
+    def _load_cached_medium() -> str | None:
+        try:
+            with open(os.path.join(cache_dir(), "medium"), "r") as f:
+                key, medium = f.read().split("\n")[:2]
+        except (OSError, ValueError):
+            return None
+        return medium if key == KGPOptions._terminal_key() else None
+
+    @staticmethod
+    def _store_cached_medium(medium: str) -> None:
+        try:
+            os.makedirs(cache_dir(), exist_ok=True)
+            with open(os.path.join(cache_dir(), "medium"), "w") as f:
+                f.write(f"{KGPOptions._terminal_key()}\n{medium}\n")
+        except OSError as e:
+            logging.debug("Failed to cache transmission medium: %s", e)
 
     def _detect_transmission_medium(self) -> None:
-        if self.transmission_medium == "auto":
-            if KGPQuery.query_transmission_medium_support(medium="s", format="32" if not self.transfer_png else "100"):
-                self.transmission_medium = "s"
-            elif KGPQuery.query_transmission_medium_support(medium="t", format="32" if not self.transfer_png else "100"):
-                self.transmission_medium = "t"
-            elif KGPQuery.query_transmission_medium_support(medium="d", format="32" if not self.transfer_png else "100"):
-                self.transmission_medium = "d"
+        if self._transmission_medium == "auto":
+            format = "32" if not self.transfer_png else "100"
+            # The medium detected by a previous run in the same terminal only needs to be confirmed
+            cached_medium = self._load_cached_medium()
+            if cached_medium is not None and KGPQuery.query_transmission_medium_support(cached_medium, format):
+                self._transmission_medium = cached_medium
             else:
-                logging.warning("No supported transmission medium detected, defaulting to direct transmission")
-                self.transmission_medium = "d"
-
-        logging.debug(f"Transmission medium: {self.transmission_medium}")
+                # In order of preference, all queried at once
+                media = ("s", "t", "d")
+                support = KGPQuery.query_transmission_media_support([(medium, format) for medium in media])
+                for medium, supported in zip(media, support):
+                    if supported:
+                        self._transmission_medium = medium
+                        self._store_cached_medium(medium)
+                        break
+                else:
+                    logging.warning("No supported transmission medium detected, defaulting to direct transmission")
+                    self._transmission_medium = "d"
+
+        logging.debug("Transmission medium: %s", self._transmission_medium)
@@ -1,18 +1,27 @@
 import logging
-from PIL import Image
 from io import BytesIO
+from typing import TYPE_CHECKING
 
-from .utils import smart_resize
+from . import lazy_PIL
+from .utils import image_raw_chunks, smart_resize, smart_resize_dimensions
 from .cli_options import KGPOptions
 from .medium import KGPMedium, KGPMediumCreationError
 
+if TYPE_CHECKING:
+    from PIL import Image
+
+# Subsequent chunks only need to specify whether more chunks follow (m=1) or not (m=0)
+_KGP_CHUNK_HEADER = b"\033_Gm=1;"
+_KGP_LAST_CHUNK_HEADER = b"\033_Gm=0;"
+_KGP_FOOTER = b"\033\\"
+
 
 class KGPEncoderBase:
     image_id: int
     # Original image
-    image: Image.Image
+    image: "Image.Image"
     # Resized image that fits the terminal dimensions
-    resized_image: Image.Image
+    resized_image: "Image.Image"
     # Medium
     medium_mgr: KGPMedium
 
@@ -22,16 +31,33 @@ class KGPEncoderBase:
 
     transfer_png: bool
 
+    # Headers of the escape sequence if the payload fits in a single chunk / of the first chunk otherwise,
+    # fixed once the medium is initialized
+    _header: bytes
+    _first_chunk_header: bytes
+
     def __init__(self, options: KGPOptions):
         self.image_id = options.image_id
         self.transfer_png = options.transfer_png
         self._init_image(options)
         self._init_size(options)
         self._init_medium(options)
+        self._init_headers()
 
     def _init_image(self, options: KGPOptions) -> None:
         """Load the image and convert it to a supported pixel format"""
-        image = Image.open(options.path)
+        image = lazy_PIL.Image.open(options.path)
+        if image.format == "JPEG":
+            # Let libjpeg decode at a reduced scale if the image will be downsized anyway,
+            # keeping some headroom (same as Image.thumbnail) for the final resampling
+            width, height = smart_resize_dimensions(image.size,
+                                                    display_cols=options.display_cols,
+                                                    display_rows=options.display_rows,
+                                                    cell_width=options.cell_width,
+                                                    cell_height=options.cell_height,
+                                                    max_cols=options.max_cols,
+                                                    max_rows=options.max_rows)
+            image.draft(None, (width * 2, height * 2))
         if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
             self.image = image.convert("RGBA")
             logging.debug("Image has alpha channel, using RGBA format")
@@ -55,37 +81,53 @@ class KGPEncoderBase:
 
     def _init_medium(self, options: KGPOptions) -> None:
         """Initialize the transmission medium for the image data"""
-        data = b""
+        data: bytes | list[bytes] = b""
         if self.transfer_png:
+            png_level = options.png_level
+            if png_level < 0:
+                # PNG data is not compressed again for direct transmission, where it goes through the
+                # (often remote) terminal connection, so keep libpng's default level there.
+                # Shared memory and temp files are only read locally and decoded once,
+                # so a low level is the better trade-off for them
+                png_level = 6 if options.transmission_medium == "d" else 1
             buf = BytesIO()
-            self.image.save(buf, format="PNG")
+            self.image.save(buf, format="PNG", compress_level=png_level)
             data = buf.getvalue()
         else:
-            data = self.resized_image.tobytes()
+            data = image_raw_chunks(self.resized_image)
 
         try:
             self.medium_mgr = KGPMedium.create(
-                image_id=self.image_id, data=data, medium=options.transmission_medium)
+                image_id=self.image_id, data=data, medium=options.transmission_medium,
+                precompressed=self.transfer_png, compression_level=options.compression_level)
         except KGPMediumCreationError as e:
             logging.warning(f"Failed to initialize transmission medium: {e}. Retrying with direct transmission.")
             try:
                 self.medium_mgr = KGPMedium.create(
-                    image_id=self.image_id, data=data, medium="d")
+                    image_id=self.image_id, data=data, medium="d",
+                    precompressed=self.transfer_png, compression_level=options.compression_level)
             except KGPMediumCreationError as e:
                 raise RuntimeError("Failed to initialize transmission medium") from e
 
-    def _format_KGP(self, payload: str, options_str: str, chunk_size: int) -> list[str]:
+    def _init_headers(self) -> None:
+        """Generate the options once and precompute the escape sequence headers containing them"""
+        options_str = self._gen_options()
+        self._header = f"\033_G{options_str};".encode("ascii")
+        self._first_chunk_header = f"\033_G{options_str},m=1;".encode("ascii")
+
+    def _format_KGP(self, payload: bytes, chunk_size: int) -> list[bytes]:
         """Format the KGP payload into one or more escape sequences based on the chunk size"""
         if len(payload) <= chunk_size:
-            return [f"\033_G{options_str};{payload}\033\\"]
+            return [b"".join((self._header, payload, _KGP_FOOTER))]
         else:
-            ret = [f"\033_G{options_str},m=1;{payload[:chunk_size]}\033\\"]
+            # Slicing a memoryview does not copy the (potentially large) payload
+            view = memoryview(payload)
+            ret = [b"".join((self._first_chunk_header, view[:chunk_size], _KGP_FOOTER))]
             for offset in range(chunk_size, len(payload), chunk_size):
-                chunk = payload[offset:offset + chunk_size]
                 # m=0 for the last chunk, m=1 for all previous
-                m = 1 if offset + chunk_size < len(payload) else 0
                 # The other options only need to be specified in the first chunk, subsequent chunks can omit them
-                ret.append(f"\033_Gm={m};{chunk}\033\\")
+                header = _KGP_CHUNK_HEADER if offset + chunk_size < len(payload) else _KGP_LAST_CHUNK_HEADER
+                ret.append(b"".join((header, view[offset:offset + chunk_size], _KGP_FOOTER)))
             return ret
 
     def _gen_options(self) -> str:
@@ -108,14 +150,14 @@ class KGPEncoderBase:
             f"s={self.resized_image.width},v={self.resized_image.height}"\
             + self.medium_mgr.medium_options()
 
-    def construct_KGP(self, chunk_size: int = 4096) -> list[str]:
+    def construct_KGP(self, chunk_size: int = 4096) -> list[bytes]:
         """Construct the KGP escape sequences for the image"""
-        if chunk_size <= 0:
-            raise ValueError("Chunk size must be a positive integer.")
+        # Base64 encodes 3 bytes as 4 characters, all chunks except the last must therefore be a multiple of 4
+        if chunk_size <= 0 or chunk_size % 4 != 0:
+            raise ValueError("Chunk size must be a positive multiple of 4.")
 
-        options = self._gen_options()
         payload = self.medium_mgr.construct_payload()
-        ret = self._format_KGP(payload, options, chunk_size)
+        ret = self._format_KGP(payload, chunk_size)
         return ret
 
     def delete_image(self) -> str:
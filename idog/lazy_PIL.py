@@ -0,0 +1,18 @@
+"""
+Deferred access to Pillow submodules
+
+Importing Pillow is by far the most expensive part of the startup, and it is not needed at all
+for code paths such as ``--help`` or ``--query``. Accessing e.g. ``lazy_PIL.Image`` imports
+``PIL.Image`` on first use and caches it in this module afterwards.
+"""
+import importlib
+
+_SUBMODULES = ("Image", "ImageFile")
+
+
+def __getattr__(name: str):
+    if name in _SUBMODULES:
+        module = importlib.import_module(f"PIL.{name}")
+        globals()[name] = module
+        return module
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
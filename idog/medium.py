@@ -1,32 +1,41 @@
 import os
-from multiprocessing import shared_memory
 from abc import ABC, abstractmethod
-import tempfile
+from typing import TYPE_CHECKING
 
 from .utils import base64_encode, zlib_compress
 
+if TYPE_CHECKING:
+    from multiprocessing import shared_memory
+
 
 class KGPMediumCreationError(Exception):
     pass
 
 
 class KGPMedium(ABC):
+    # Value of the t= key, set by each subclass
+    MEDIUM_ID: str
+
     image_id: int
 
-    def __init__(self, image_id: int, data: bytes) -> None:
+    def __init__(self, image_id: int, data: bytes | list[bytes]) -> None:
         self.image_id = image_id
 
+    @staticmethod
+    def _chunks(data: bytes | list[bytes]) -> list[bytes]:
+        """The data can also be given as a list of chunks, to be treated as their concatenation"""
+        return data if isinstance(data, list) else [data]
+
     @abstractmethod
     def cleanup(self):
         pass
 
     @abstractmethod
-    def construct_payload(self) -> str:
+    def construct_payload(self) -> bytes:
         pass
 
-    @abstractmethod
     def medium_identifier(self) -> str:
-        pass
+        return self.MEDIUM_ID
 
     @abstractmethod
     def medium_options(self) -> str:
@@ -37,9 +46,19 @@ class KGPMedium(ABC):
         pass
 
     @staticmethod
-    def create(image_id: int, data: bytes, medium: str) -> "KGPMedium":
+    def create(image_id: int, data: bytes | list[bytes], medium: str,
+               precompressed: bool = False, compression_level: int = -1) -> "KGPMedium":
+        """
+        Create the manager for the given transmission medium
+
+        data can be a list of chunks instead of a single bytes object,
+        which saves joining large data (e.g. raw pixel data) only to copy it to the medium afterwards
+
+        precompressed indicates that data is already compressed (e.g. PNG), and compression_level
+        is the zlib level to use otherwise, both only relevant for direct transmission
+        """
         if medium == "d":
-            return KGPMediumDirect(image_id, data)
+            return KGPMediumDirect(image_id, data, precompressed=precompressed, compression_level=compression_level)
         elif medium == "s":
             return KGPMediumSharedMemory(image_id, data)
         elif medium == "t":
@@ -51,80 +70,90 @@ class KGPMedium(ABC):
 
 
 class KGPMediumDirect(KGPMedium):
+    MEDIUM_ID = "d"
+
     original_size: int
     is_png: bool
-    payload: str
+    compressed: bool
+    payload: bytes
 
     @staticmethod
     def detect_png(data: bytes) -> bool:
         return data.startswith(b"\x89PNG\r\n\x1a\n")
 
-    def __init__(self, image_id: int, data: bytes) -> None:
+    def __init__(self, image_id: int, data: bytes | list[bytes],
+                 precompressed: bool = False, compression_level: int = -1) -> None:
         super().__init__(image_id, data)
-        self.original_size = len(data)
-        self.is_png = self.detect_png(data)
-        self.payload = base64_encode(zlib_compress(data))
+        chunks = self._chunks(data)
+        self.original_size = sum(len(chunk) for chunk in chunks)
+        self.is_png = len(chunks) > 0 and self.detect_png(chunks[0])
+        # Compressing already compressed data again barely shrinks it but costs a full pass over it
+        self.compressed = not precompressed
+        if self.compressed:
+            self.payload = base64_encode(zlib_compress(chunks, compression_level))
+        else:
+            self.payload = base64_encode(b"".join(chunks))
 
     def cleanup(self):
         pass
 
-    def construct_payload(self) -> str:
+    def construct_payload(self) -> bytes:
         return self.payload
 
-    def medium_identifier(self) -> str:
-        return "d"
-
     def medium_options(self) -> str:
-        return f",i={self.image_id},t={self.medium_identifier()},o=z{f",S={self.original_size}" if self.is_png else ""}"
+        options = f",i={self.image_id},t={self.MEDIUM_ID}"
+        if self.do_compression():
+            # o=z: zlib compressed, S=...: size of the uncompressed PNG data
+            options += f",o=z{f",S={self.original_size}" if self.is_png else ""}"
+        return options
 
     def do_compression(self) -> bool:
-        return True
+        return self.compressed
 
 
 class KGPMediumSharedMemory(KGPMedium):
+    MEDIUM_ID = "s"
+
     shm_name: str
-    shm: shared_memory.SharedMemory | None
+    payload: bytes
+    shm: "shared_memory.SharedMemory | None"
 
     def _construct_memory_name(self) -> str:
         return f"idog_{self.image_id}"
 
-    def __init__(self, image_id: int, data: bytes) -> None:
+    def _write(self, chunks: list[bytes]) -> None:
+        offset = 0
+        for chunk in chunks:
+            self.shm.buf[offset:offset + len(chunk)] = chunk
+            offset += len(chunk)
+
+    def __init__(self, image_id: int, data: bytes | list[bytes]) -> None:
+        from multiprocessing import shared_memory
+
         super().__init__(image_id, data)
         self.shm_name = self._construct_memory_name()
-        data_len = len(data)
+        self.payload = base64_encode(self.shm_name.encode("utf-8"))
+        chunks = self._chunks(data)
+        data_len = sum(len(chunk) for chunk in chunks)
 
-        for _ in range(2):
+        try:
+            self.shm = shared_memory.SharedMemory(name=self.shm_name, create=True, size=data_len, track=False)
+        except FileExistsError:
+            # Most likely left over from a previous run with the same image ID, replace it
+            try:
+                existing_shm = shared_memory.SharedMemory(name=self.shm_name, create=False, track=False)
+                existing_shm.close()
+                existing_shm.unlink()
+            except FileNotFoundError:
+                pass
             try:
                 self.shm = shared_memory.SharedMemory(name=self.shm_name, create=True, size=data_len, track=False)
-                if self.shm.buf is None:
-                    raise KGPMediumCreationError("Failed to create shared memory segment")
-                self.shm.buf[:data_len] = data
-                break
-            except FileExistsError:
-                try:
-                    existing_shm = shared_memory.SharedMemory(name=self.shm_name, create=False, track=False)
-                except FileNotFoundError:
-                    continue
-
-                if existing_shm.size < data_len:
-                    try:
-                        existing_shm.close()
-                        existing_shm.unlink()
-                    except FileNotFoundError:
-                        pass
-                    continue
-                self.shm = existing_shm
-                if self.shm.buf is None:
-                    try:
-                        existing_shm.close()
-                        existing_shm.unlink()
-                    except FileNotFoundError:
-                        pass
-                    continue
-                self.shm.buf[:data_len] = data
-                break
-        else:
-            raise KGPMediumCreationError(f"Could not initialize SharedMemory.")
+            except FileExistsError as e:
+                raise KGPMediumCreationError("Could not initialize SharedMemory.") from e
+
+        if self.shm.buf is None:
+            raise KGPMediumCreationError("Failed to create shared memory segment")
+        self._write(chunks)
 
         self.image_id = image_id
 
@@ -136,30 +165,39 @@ class KGPMediumSharedMemory(KGPMedium):
             except Exception:
                 pass
 
-    def construct_payload(self) -> str:
-        return base64_encode(self.shm_name.encode("utf-8"))
-
-    def medium_identifier(self) -> str:
-        return "s"
+    def construct_payload(self) -> bytes:
+        return self.payload
 
     def medium_options(self) -> str:
-        return f",i={self.image_id},t={self.medium_identifier()}"
+        return f",i={self.image_id},t={self.MEDIUM_ID}"
 
     def do_compression(self) -> bool:
         return False
 
 
 class KGPMediumTempFile(KGPMedium):
+    MEDIUM_ID = "t"
+
     file_path: str
+    payload: bytes
 
-    def _construct_file_path(self) -> str:
-        return tempfile.mkstemp(prefix="tty-graphics-protocol_")[1]
+    def _create_file(self) -> tuple[int, str]:
+        """Create the file, returning its already opened file descriptor and its path"""
+        import tempfile
+        return tempfile.mkstemp(prefix="tty-graphics-protocol_")
 
-    def __init__(self, image_id: int, data: bytes) -> None:
+    def __init__(self, image_id: int, data: bytes | list[bytes]) -> None:
         super().__init__(image_id, data)
-        self.file_path = self._construct_file_path()
-        with open(self.file_path, "wb") as f:
-            f.write(data)
+        fd, self.file_path = self._create_file()
+        self.payload = base64_encode(self.file_path.encode("utf-8"))
+        # Writing to the descriptor directly skips the copy into a file object's buffer
+        try:
+            for chunk in self._chunks(data):
+                view = memoryview(chunk)
+                while view:
+                    view = view[os.write(fd, view):]
+        finally:
+            os.close(fd)
 
     def cleanup(self):
         try:
@@ -167,19 +205,15 @@ class KGPMediumTempFile(KGPMedium):
         except Exception:
             pass
 
-    def construct_payload(self) -> str:
-        return base64_encode(self.file_path.encode("utf-8"))
-
-    def medium_identifier(self) -> str:
-        return "t"
+    def construct_payload(self) -> bytes:
+        return self.payload
 
     def medium_options(self) -> str:
-        return f",i={self.image_id},t={self.medium_identifier()}"
+        return f",i={self.image_id},t={self.MEDIUM_ID}"
 
     def do_compression(self) -> bool:
         return False
 
 
 class KGPMediumFile(KGPMediumTempFile):
-    def medium_identifier(self) -> str:
-        return "f"
+    MEDIUM_ID = "f"
@@ -1,70 +1,106 @@
 import re
 import os
+import functools
 import sys
-import termios
 import logging
-from select import select
-import time
+from contextlib import contextmanager
+from typing import Iterator
 
 from .utils import NoInteractiveTerminalError, atty_fd, random_ID, mock_png_data
 from .medium import KGPMedium
 
 
+# Every terminal answers the primary device attributes query, so appending it to the actual queries
+# and waiting for its reply ensures that all replies to the preceding queries have arrived
+_FENCE_CODE = "\033[c"
+_FENCE_RESPONSE = re.compile(rb"\033\[\?[0-9;]*c")
+# Reply to a successful graphics protocol query, the image ID tells which query it belongs to
+_OK_RESPONSE = re.compile(rb"\033_Gi=(\d+);OK\033\\")
+
+# Replies take a full network round trip over SSH, allow more time for them there
+_DEFAULT_TIMEOUT = 1 if os.environ.get("SSH_TTY") else 0.1
+
+# Results of the transmission medium queries by (medium, format). Terminal capabilities don't change during
+# the lifetime of the process, and the random image IDs used for the queries don't affect the result.
+_CAP_CACHE: dict[tuple[str, str], bool] = {}
+
+
 class KGPQuery():
     @staticmethod
-    def _do_query(code: str, expected_response: re.Pattern, fence_response: re.Pattern, timeout: float = -1) -> bool:
-        """Helper function to send a query and wait for the expected response"""
+    def _do_query(code: str, timeout: float = -1) -> bytes:
+        """Helper function to send one or more queries followed by the fence, and collect the response until the fence is answered"""
+        from select import select
+
         if timeout < 0:
-            timeout = 1 if os.environ.get("SSH_TTY") else 0.1
+            timeout = _DEFAULT_TIMEOUT
 
         try:
             fd = atty_fd()
         except NoInteractiveTerminalError as e:
             logging.warning(f"Cannot perform query: {e}")
-            return False
+            return b""
 
-        old_settings = termios.tcgetattr(fd)
-        response = ""
+        response = bytearray()
 
         try:
-            new_settings = termios.tcgetattr(fd)
-            # Disable canonical mode and echo
-            new_settings[3] = new_settings[3] & ~termios.ICANON & ~termios.ECHO
-            termios.tcsetattr(fd, termios.TCSANOW, new_settings)
-
-            sys.stdout.write(code)
-            sys.stdout.flush()
-
-            success = False
-            while True:
-                # Set a timeout to prevent blocking indefinitely
-                r, w, e = select([fd], [], [], timeout)
-                if not r:
-                    break
-
-                char = os.read(fd, 1)
-                if not char:
-                    break
-
-                response += char.decode('ascii', errors='ignore')
+            with KGPQuery._raw_mode(fd):
+                code += _FENCE_CODE
+                if os.environ.get("TMUX"):
+                    code = KGPQuery._tmux_passthrough(code)
+                sys.stdout.write(code)
+                sys.stdout.flush()
+
+                while True:
+                    # Set a timeout to prevent blocking indefinitely
+                    r, w, e = select([fd], [], [], timeout)
+                    if not r:
+                        break
+
+                    data = os.read(fd, 4096)
+                    if not data:
+                        break
+
+                    # Replies up to the last string terminator are complete and have already been checked
+                    terminator = response.rfind(b"\033\\")
+                    scan_start = terminator + 2 if terminator >= 0 else 0
+
+                    response += data
+
+                    if _FENCE_RESPONSE.search(response, scan_start):
+                        break
+        except Exception:
+            logging.warning("Exception occurred while querying terminal support", exc_info=True)
+            return b""
 
-                if expected_response.search(response):
-                    success = True
+        response = bytes(response)
+        # Lazy formatting, the reply is only escaped if the message is actually emitted
+        logging.debug("Received response: %r", response)
 
-                if fence_response.search(response):
-                    break
+        return response
 
-            logging.debug(f"Received response: {response.encode('unicode_escape')}")
+    @staticmethod
+    @contextmanager
+    def _raw_mode(fd: int) -> Iterator[None]:
+        """Disable canonical mode and echo on the terminal, restoring the previous settings on exit"""
+        import termios
 
-            return success
-        except Exception:
-            logging.warning("Exception occurred while querying terminal support", exc_info=True)
+        old_settings = termios.tcgetattr(fd)
+        new_settings = old_settings.copy()
+        new_settings[3] = new_settings[3] & ~termios.ICANON & ~termios.ECHO
+        termios.tcsetattr(fd, termios.TCSANOW, new_settings)
+        try:
+            yield
         finally:
             termios.tcsetattr(fd, termios.TCSANOW, old_settings)
 
-        return False
+    @staticmethod
+    def _tmux_passthrough(code: str) -> str:
+        """Wrap escape sequences so that tmux forwards them to the outer terminal instead of swallowing them"""
+        # The fence is wrapped as well, otherwise tmux would answer it itself before the outer terminal replies
+        return "\033Ptmux;" + code.replace("\033", "\033\033") + "\033\\"
 
     @staticmethod
+    @functools.lru_cache(maxsize=8)
     def _mock_data(format: str, width: int = 1, height: int = 1) -> bytes:
         if format == "32":
             return b"\x00\x00\x00\x00" * (width * height)
@@ -79,65 +115,88 @@ class KGPQuery():
     def query_support() -> bool:
         return KGPQuery.query_transmission_medium_support(medium="d", format="24")
 
+    @staticmethod
+    def _is_unicode_placeholder_terminal() -> bool:
+        return bool(os.environ.get("KITTY_PID") or os.environ.get("GHOSTTY_SHELL_FEATURES"))
+
+    @staticmethod
+    def _probe_always() -> bool:
+        """Whether capabilities implied by the environment should still be confirmed by querying the terminal"""
+        return os.environ.get("IDOG_PROBE_ALWAYS") == "1"
+
     @staticmethod
     def query_unicode_placeholder_support() -> bool:
-        if os.environ.get("KITTY_PID") or os.environ.get("GHOSTTY_SHELL_FEATURES"):
+        if not KGPQuery._is_unicode_placeholder_terminal():
+            return False
+        # Kitty and Ghostty support Unicode placeholders along with the graphics protocol itself,
+        # set IDOG_PROBE_ALWAYS=1 to confirm it with a query anyway (e.g. when the variables leak into another terminal)
+        if KGPQuery._probe_always():
             return KGPQuery.query_support()
-        return False
+        return True
 
     @staticmethod
     def query_transmission_medium_support(medium: str = "d", format: str = "32") -> bool:
-        kgp_medium = None
+        return KGPQuery.query_transmission_media_support([(medium, format)])[0]
+
+    @staticmethod
+    def query_transmission_media_support(queries: list[tuple[str, str]]) -> list[bool]:
+        """Query support for multiple (medium, format) pairs, the ones not cached yet in a single round trip"""
+        missing = [query for query in dict.fromkeys(queries) if query not in _CAP_CACHE]
+        if missing:
+            _CAP_CACHE.update(zip(missing, KGPQuery._query_transmission_media_support(missing)))
+        return [_CAP_CACHE[query] for query in queries]
+
+    @staticmethod
+    def _query_transmission_media_support(queries: list[tuple[str, str]]) -> list[bool]:
+        kgp_media: list[KGPMedium | None] = []
         try:
             mock_width = 1
             mock_height = 1
-            kgp_medium = KGPMedium.create(medium=medium,
-                                          image_id=random_ID(0xFFFFFF),
-                                          data=KGPQuery._mock_data(format, mock_width, mock_height))
-            query_code = f"\033_Gs={mock_width},v={mock_height},a=q,f={format}{kgp_medium.medium_options()};{kgp_medium.construct_payload()}\033\\"
-            expected_response = re.compile(rf"\033_Gi={kgp_medium.image_id};OK\033\\")
-            fence_code = "\033[c"
-            fence_response = re.compile(r"\033\[\?[0-9;]*c")
-            return KGPQuery._do_query(query_code + fence_code, expected_response, fence_response)
+            query_code = ""
+            for medium, format in queries:
+                try:
+                    kgp_medium = KGPMedium.create(medium=medium,
+                                                  image_id=random_ID(0xFFFFFF),
+                                                  data=KGPQuery._mock_data(format, mock_width, mock_height))
+                except Exception as e:
+                    # Only this medium is unsupported, the others can still be queried
+                    logging.warning(f"Exception occurred while querying transmission medium support: {e}")
+                    kgp_media.append(None)
+                    continue
+                kgp_media.append(kgp_medium)
+                query_code += f"\033_Gs={mock_width},v={mock_height},a=q,f={format}{kgp_medium.medium_options()};{kgp_medium.construct_payload().decode("ascii")}\033\\"
+            response = KGPQuery._do_query(query_code) if query_code else b""
+            supported_ids = {int(match.group(1)) for match in _OK_RESPONSE.finditer(response)}
+            return [kgp_medium is not None and kgp_medium.image_id in supported_ids for kgp_medium in kgp_media]
         except Exception as e:
             logging.warning(f"Exception occurred while querying transmission medium support: {e}")
-            return False
+            return [False] * len(queries)
         finally:
-            if kgp_medium is not None:
-                kgp_medium.cleanup()
+            for kgp_medium in kgp_media:
+                if kgp_medium is not None:
+                    kgp_medium.cleanup()
 
     @staticmethod
     def query_all() -> dict[str, bool]:
-        ret = {}
+        queries = {
+            "Direct Transmission (32bit)": ("d", "32"),
+            "Direct Transmission (24bit)": ("d", "24"),
+            "Direct Transmission (PNG)": ("d", "100"),
+            "Shared Memory Transmission (32bit)": ("s", "32"),
+            "Shared Memory Transmission (24bit)": ("s", "24"),
+            "Shared Memory Transmission (PNG)": ("s", "100"),
+            "Temporary File Transmission (32bit)": ("t", "32"),
+            "Temporary File Transmission (24bit)": ("t", "24"),
+            "Temporary File Transmission (PNG)": ("t", "100"),
+            "File Transmission (32bit)": ("f", "32"),
+            "File Transmission (24bit)": ("f", "24"),
+            "File Transmission (PNG)": ("f", "100"),
+        }
+        results = dict(zip(queries.keys(), KGPQuery.query_transmission_media_support(list(queries.values()))))
 
-        support_unicode_placeholders = KGPQuery.query_unicode_placeholder_support()
-        support_direct_32 = KGPQuery.query_transmission_medium_support(medium="d", format="32")
-        support_direct_24 = KGPQuery.query_transmission_medium_support(medium="d", format="24")
-        support_direct_png = KGPQuery.query_transmission_medium_support(medium="d", format="100")
-
-        support_shared_memory_32 = KGPQuery.query_transmission_medium_support(medium="s", format="32")
-        support_shared_memory_24 = KGPQuery.query_transmission_medium_support(medium="s", format="24")
-        support_shared_memory_png = KGPQuery.query_transmission_medium_support(medium="s", format="100")
-
-        support_temp_file_32 = KGPQuery.query_transmission_medium_support(medium="t", format="32")
-        support_temp_file_24 = KGPQuery.query_transmission_medium_support(medium="t", format="24")
-        support_temp_file_png = KGPQuery.query_transmission_medium_support(medium="t", format="100")
-
-        support_file_32 = KGPQuery.query_transmission_medium_support(medium="f", format="32")
-        support_file_24 = KGPQuery.query_transmission_medium_support(medium="f", format="24")
-        support_file_png = KGPQuery.query_transmission_medium_support(medium="f", format="100")
-
-        ret["Unicode Placeholders"] = support_unicode_placeholders
-        ret["Direct Transmission (32bit)"] = support_direct_32
-        ret["Direct Transmission (24bit)"] = support_direct_24
-        ret["Direct Transmission (PNG)"] = support_direct_png
-        ret["Shared Memory Transmission (32bit)"] = support_shared_memory_32
-        ret["Shared Memory Transmission (24bit)"] = support_shared_memory_24
-        ret["Shared Memory Transmission (PNG)"] = support_shared_memory_png
-        ret["Temporary File Transmission (32bit)"] = support_temp_file_32
-        ret["Temporary File Transmission (24bit)"] = support_temp_file_24
-        ret["Temporary File Transmission (PNG)"] = support_temp_file_png
-        ret["File Transmission (32bit)"] = support_file_32
-        ret["File Transmission (24bit)"] = support_file_24
-        ret["File Transmission (PNG)"] = support_file_png
+        ret = {}
+        # Same as query_unicode_placeholder_support(), but reusing the result of the batched queries
+        ret["Unicode Placeholders"] = KGPQuery._is_unicode_placeholder_terminal() \
+            and (not KGPQuery._probe_always() or results["Direct Transmission (24bit)"])
+        ret.update(results)
         return ret
@@ -1,12 +1,31 @@
 from .encoder import KGPEncoderBase
-from .utils import random_ID
+from .cli_options import KGPOptions
 from .constants import KGP_PLACEHOLDER, KGP_DIACRITICS
 
+# Reset the foreground color after each line of placeholders
+_PLACEHOLDER_SUFFIX = "\033[39m"
+# First cell of each row: Placehoder + Row Diacritic + Column Diacritic, indexed by row
+_ROW_MIDDLES = tuple(f"{KGP_PLACEHOLDER}{diacritic}{KGP_DIACRITICS[0]}" for diacritic in KGP_DIACRITICS)
+
 
 class KGPEncoderUnicode(KGPEncoderBase):
-    def _init_id(self):
-        """Initialize a smaller random image ID"""
-        self.image_id = random_ID(0xFFFFFF)
+    # Parts of the placeholder lines that are the same for every row,
+    # fixed once the image ID and the display size are known
+    _id_color_prefix: str
+    _placeholder_run: str
+
+    def __init__(self, options: KGPOptions):
+        super().__init__(options)
+        self._init_placeholders()
+
+    def _init_placeholders(self) -> None:
+        """Precompute the row-independent parts of the Unicode placeholder lines"""
+        # Using 24-bit True Color foreground to encode the image ID,
+        # the maximum id is therefore 0xFFFFFF, which is likely enough
+        self._id_color_prefix = f"\033[38;2;{(self.image_id >> 16) & 0xFF};{(self.image_id >> 8) & 0xFF};{self.image_id & 0xFF}m"
+        # Only the first cell needs diacritics, the column and row indices of the following ones
+        # are automatically determined by the terminal
+        self._placeholder_run = KGP_PLACEHOLDER * (self.display_cols - 1)
 
     def _gen_options(self) -> str:
         """Generate the options string for the KGP escape sequence"""
@@ -17,20 +36,5 @@ class KGPEncoderUnicode(KGPEncoderBase):
 
     def construct_unicode_placeholders(self) -> list[str]:
         """Construct the Unicode placeholders for the image"""
-        # Using 24-bit True Color foreground to encode the image ID,
-        # the maximum id is therefore 0xFFFFFF, which is likely enough
-        image_id_str = f"\033[38;2;{(self.image_id >> 16) & 0xFF};{(self.image_id >> 8) & 0xFF};{self.image_id & 0xFF}m"
-        ret = []
-        for i in range(self.display_rows):
-            line = image_id_str
-
-            # Placehoder + Row Diacritic + Column Diacritic
-            line += f"{KGP_PLACEHOLDER}{KGP_DIACRITICS[i]}{KGP_DIACRITICS[0]}"
-            for _ in range(1, self.display_cols):
-                # Col index and row index will be automatically determined
-                line += KGP_PLACEHOLDER
-
-            line += "\033[39m"
-            ret.append(line)
-
-        return ret
+        return [f"{self._id_color_prefix}{_ROW_MIDDLES[i]}{self._placeholder_run}{_PLACEHOLDER_SUFFIX}"
+                for i in range(self.display_rows)]
@@ -1,18 +1,54 @@
-import base64
+import binascii
+import functools
 import os
 import random
 import zlib
 import struct
 import fcntl
-import array
 import termios
 import sys
-from PIL import Image
+from typing import TYPE_CHECKING
 
+from . import lazy_PIL
 
-def random_ID(max: int = 0xFFFFFF) -> int: return random.randint(0, max)
-def base64_encode(data: bytes) -> str: return base64.b64encode(data).decode("ascii")
-def zlib_compress(data: bytes) -> bytes: return zlib.compress(data)
+if TYPE_CHECKING:
+    from PIL import Image
+
+# The IEND chunk has no data, so its length and CRC are always the same
+_IEND_CHUNK = b"\x00\x00\x00\x00IEND\xaeB`\x82"
+# Reused by terminal_dimensions for the struct winsize (4 unsigned shorts) filled in by the ioctl
+_WINSZ_BUF = bytearray(8)
+
+
+def random_ID(max: int = 0xFFFFFF) -> int:
+    """Return a random ID uniformly distributed in [0, max], where max must be of the form 2**n - 1"""
+    # Masking the random bits only keeps the distribution uniform if all bits below the highest one are set
+    if max < 0 or max & (max + 1):
+        raise ValueError(f"Maximum ID must be of the form 2**n - 1, got {max:#x}")
+    return random.getrandbits(max.bit_length()) & max
+
+
+def base64_encode(data: bytes) -> bytes: return binascii.b2a_base64(data, newline=False)
+
+
+@functools.cache
+def _zlib_backend():
+    """ISA-L (from the optional isal package) is a drop-in replacement for zlib, using SIMD to compress several times faster"""
+    try:
+        from isal import isal_zlib
+        return isal_zlib
+    except ImportError:
+        return zlib
+
+
+def zlib_compress(chunks: list[bytes], level: int = -1) -> bytes:
+    """Compress the concatenation of the given chunks, level -1 means the default compression level"""
+    backend = _zlib_backend()
+    if level < 0:
+        level = backend.Z_DEFAULT_COMPRESSION
+    # ISA-L supports fewer levels than zlib
+    compressor = backend.compressobj(min(level, backend.Z_BEST_COMPRESSION))
+    return b"".join([compressor.compress(chunk) for chunk in chunks] + [compressor.flush()])
 
 
 def png_makechunk(type: bytes, data: bytes) -> bytes:
@@ -25,22 +61,30 @@ def mock_png_data(width: int, height: int) -> bytes:
     ihdr = struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)
     data += png_makechunk(b"IHDR", ihdr)
     # IDAT
-    compressor = zlib.compressobj(level=9, strategy=zlib.Z_DEFAULT_STRATEGY)
-    idat = compressor.compress(b"".join(
-        b"\x00" + b"\xff\xff\xff\x80" * width for _ in range(height)
-    )) + compressor.flush()
+    # Every scanline is identical: filter type 0 followed by the same RGBA pixels.
+    # Such uniform data compresses just as well at the fastest level
+    row = b"\x00" + b"\xff\xff\xff\x80" * width
+    idat = zlib.compress(row * height, 1)
     data += png_makechunk(b"IDAT", idat)
     # IEND
-    data += png_makechunk(b"IEND", b"")
+    data += _IEND_CHUNK
     return data
 
 
+def cache_dir() -> str:
+    """Directory for idog's cached data, following the XDG base directory specification"""
+    return os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "idog")
+
+
 class NoInteractiveTerminalError(Exception):
     pass
 
 
+@functools.cache
 def atty_fd() -> int:
     """Return a file descriptor for an active terminal, or raise an exception if none found"""
+    # The standard streams don't change during the lifetime of the process, so the first result is cached.
+    # Exceptions are not cached, the lookup is repeated if no terminal was found
     for fd in (sys.stdin.fileno(), sys.stdout.fileno(), sys.stderr.fileno()):
         if os.isatty(fd):
             return fd
@@ -49,61 +93,46 @@ def atty_fd() -> int:
 
 def terminal_dimensions() -> tuple[int, int, int, int]:
     """Obtain terminal dimensions (columns, rows) via ioctl"""
-    buf = array.array('H', [0, 0, 0, 0])
-    fcntl.ioctl(atty_fd(), termios.TIOCGWINSZ, buf)
-    rows, cols, x_pixels, y_pixels = buf
+    fcntl.ioctl(atty_fd(), termios.TIOCGWINSZ, _WINSZ_BUF)
+    rows, cols, x_pixels, y_pixels = struct.unpack("HHHH", _WINSZ_BUF)
     if 0 in (rows, cols, x_pixels, y_pixels):
         raise RuntimeError("Failed to get terminal dimensions")
     return cols, rows, x_pixels, y_pixels
 
 
-def smart_resize(image: Image.Image,
-                 display_cols: int, display_rows: int,
-                 cell_width: int, cell_height: int,
-                 max_cols: int, max_rows: int) -> Image.Image:
+def image_raw_chunks(image: "Image.Image") -> list[bytes]:
     """
-    Resize the image to fit within the specified display dimensions
-
-    :param image:
-        The image to resize
-    :type image: Image.Image
-    :param display_cols:
-        The exact number of columns of the resized image.
-        If positive, the image will be stretched to fit this width.
-        If zero or negative, the width will be as large as possible while respecting the other constraints.
-    :type display_cols: int
-    :param display_rows:
-        The exact number of rows of the resized image.
-        If positive, the image will be stretched to fit this height.
-        If zero or negative, the height will be as large as possible while respecting the other constraints.
-    :type display_rows: int
-    :param cell_width:
-        The width of a character cell in pixels.
-        Set to 1 for pixel-perfect resizing, or a larger value to resize based on character cell dimensions.
-        Also used as the minimum width of the resized image.
-    :type cell_width: int
-    :param cell_height:
-        The height of a character cell in pixels.
-        Set to 1 for pixel-perfect resizing, or a larger value to resize based on character cell dimensions.
-        Also used as the minimum height of the resized image.
-    :type cell_height: int
-    :param max_cols:
-        The maximum number of columns of the resized image.
-        If positive, the image will be resized to fit within this width if it would otherwise exceed
-        If zero or negative, this constraint is ignored.
-    :type max_cols: int
-    :param max_rows:
-        The maximum number of rows of the resized image.
-        If positive, the image will be resized to fit within this height if it would otherwise exceed
-        If zero or negative, this constraint is ignored.
-    :type max_rows: int
-    :return:
-        The resized image
-    :rtype: Image
+    Obtain the raw pixel data of the image, same as Image.tobytes(),
+    but as the chunks produced by the encoder instead of joining them into a single (large) bytes object
     """
+    image.load()
+    if image.width == 0 or image.height == 0:
+        return []
+
+    encoder = lazy_PIL.Image._getencoder(image.mode, "raw", image.mode)
+    encoder.setimage(image.im, (0, 0) + image.size)
+    # Same buffer size as Image.tobytes()
+    bufsize = max(lazy_PIL.ImageFile.MAXBLOCK, image.width * 4)
+
+    chunks = []
+    while True:
+        _, errcode, chunk = encoder.encode(bufsize)
+        chunks.append(chunk)
+        if errcode:
+            break
+    if errcode < 0:
+        raise RuntimeError(f"Encoder error {errcode} while reading pixel data")
+    return chunks
+
+
+def smart_resize_dimensions(image_size: tuple[int, int],
+                            display_cols: int, display_rows: int,
+                            cell_width: int, cell_height: int,
+                            max_cols: int, max_rows: int) -> tuple[int, int]:
+    """Compute the size (width, height) in pixels that smart_resize would resize an image of the given size to"""
     if cell_height <= 0 or cell_width <= 0:
         raise ValueError("Cell dimensions must be positive")
-    image_width, image_height = image.size
+    image_width, image_height = image_size
     image_aspect = image_width / image_height
 
     resized_width = image_width
@@ -175,6 +204,63 @@ def smart_resize(image: Image.Image,
     if resized_height < cell_height:
         resized_height = cell_height
 
-    display_cols = int(resized_width / cell_width)
-    display_rows = int(resized_height / cell_height)
-    return image.resize((resized_width, resized_height), Image.Resampling.LANCZOS)
+    return resized_width, resized_height
+
+
+def smart_resize(image: "Image.Image",
+                 display_cols: int, display_rows: int,
+                 cell_width: int, cell_height: int,
+                 max_cols: int, max_rows: int) -> "Image.Image":
+    """
+    Resize the image to fit within the specified display dimensions
+
+    :param image:
+        The image to resize
+    :type image: Image.Image
+    :param display_cols:
+        The exact number of columns of the resized image.
+        If positive, the image will be stretched to fit this width.
+        If zero or negative, the width will be as large as possible while respecting the other constraints.
+    :type display_cols: int
+    :param display_rows:
+        The exact number of rows of the resized image.
+        If positive, the image will be stretched to fit this height.
+        If zero or negative, the height will be as large as possible while respecting the other constraints.
+    :type display_rows: int
+    :param cell_width:
+        The width of a character cell in pixels.
+        Set to 1 for pixel-perfect resizing, or a larger value to resize based on character cell dimensions.
+        Also used as the minimum width of the resized image.
+    :type cell_width: int
+    :param cell_height:
+        The height of a character cell in pixels.
+        Set to 1 for pixel-perfect resizing, or a larger value to resize based on character cell dimensions.
+        Also used as the minimum height of the resized image.
+    :type cell_height: int
+    :param max_cols:
+        The maximum number of columns of the resized image.
+        If positive, the image will be resized to fit within this width if it would otherwise exceed
+        If zero or negative, this constraint is ignored.
+    :type max_cols: int
+    :param max_rows:
+        The maximum number of rows of the resized image.
+        If positive, the image will be resized to fit within this height if it would otherwise exceed
+        If zero or negative, this constraint is ignored.
+    :type max_rows: int
+    :return:
+        The resized image, or the image itself if it already has the target size
+    :rtype: Image
+    """
+    size = smart_resize_dimensions(image.size,
+                                   display_cols=display_cols,
+                                   display_rows=display_rows,
+                                   cell_width=cell_width,
+                                   cell_height=cell_height,
+                                   max_cols=max_cols,
+                                   max_rows=max_rows)
+    # Image.resize would still copy the whole image
+    if size == image.size:
+        return image
+    # For large downscales, first shrink the image by an integer factor with Image.reduce (a cheap box filter)
+    # and only apply LANCZOS to the last step, which is visually indistinguishable but several times faster
+    return image.resize(size, lazy_PIL.Image.Resampling.LANCZOS, reducing_gap=2.0)